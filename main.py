@@ -1,68 +1,207 @@
-from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import date, datetime, time as dt_time, timedelta
 from zoneinfo import ZoneInfo
+from curl_cffi import requests as curl_requests
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 import yfinance as yf
 import redis
+import orjson
 import argparse
+import functools
+import math
+import socket
+import threading
 import time
-import json
 
 # Other Constants
-QUERY_TICK_RATE = 10.0    # Seconds
+QUERY_TICK_RATE   = 10.0    # Seconds
+QUERY_WAIT_TIME   = 5.0     # Seconds
+MARKET_CHECK_RATE = 3600    # Seconds
+MARKET_RECHECK    = 60      # Seconds
+STATUS_TTL        = 30      # Seconds
+REDIS_TIMEOUT     = 0.5     # Seconds
+NY_TZ             = ZoneInfo("America/New_York")
+READABLE_FMT      = "%m-%d-%y %I:%M:%S.%f %p %Z"
+
+# Trading hours of the market in the Eastern Time Zone, EARLY_CLOSE replaces MARKET_CLOSE
+# on the days the market closes early
+MARKET_OPEN  = dt_time(9, 30)
+MARKET_CLOSE = dt_time(16, 0)
+EARLY_CLOSE  = dt_time(13, 0)
+
+# Names of the days of the week indexed by datetime.weekday(), every gainer shares one of
+# these strings rather than each getting its own copy from strftime
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Fields of a gainer that are stored as columns in the gainers record, the day is left
+# out since the record is already keyed by the day of the week
+GAINER_COLUMNS = ("symbol", "timestamp", "datetime_iso", "datetime_readable")
 
 # Placeholder for Redis client if needed in the future
 redis_client: redis.Redis = None
 
-def IsMarketOpen() -> bool:
+# Shared HTTP session so that the connections to Yahoo are kept alive between ticks
+yf_session: curl_requests.Session = None
+
+# Result of the last time the market status was reconciled with Yahoo, only used to catch
+# closures that aren't on the calendar
+_market_check: dict = {"closed": False, "suspect": False, "next_check": 0.0}
+
+# Runs the Yahoo queries so that a slow response doesn't block the query thread
+_executor = ThreadPoolExecutor(max_workers=2)
+
+# Top gainers queries that are still in flight, keyed by their parameters. The lock is
+# reentrant since a future that is already done runs its callbacks on the submitting thread
+_inflight: dict[tuple, Future] = {}
+_inflight_lock                 = threading.RLock()
+
+@functools.lru_cache(maxsize=4)
+def MarketCalendar(year: int) -> tuple[frozenset[date], frozenset[date]]:
     """
-    Checks if the stock market is currently open
+    Computes the NYSE holidays and early closing days for a year from the exchange's rules
+
+    :param year: The year to compute the calendar for.
+    :return: A tuple of the full day holidays and the days the market closes early.
     """
-    try:
-        # Use yfinance to get market status
-        market      = yf.Market("US", timeout=1)
-        status: str = market.status.get("status")
-        if status is None:
-            return False
 
-        # Check if the market status indicates it is closed
-        if status.upper() == "CLOSED":
-            return False
+    def nth_weekday(month: int, weekday: int, n: int) -> date:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    def last_weekday(month: int, weekday: int) -> date:
+        last = date(year, month + 1, 1) - timedelta(days=1)
+        return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+    def observed(day: date) -> date:
+        # Holidays on a Saturday are observed the Friday before and on a Sunday the Monday after
+        if day.weekday() == 5:
+            return day - timedelta(days=1)
+        if day.weekday() == 6:
+            return day + timedelta(days=1)
+        return day
+
+    # Good Friday is two days before Easter Sunday (anonymous Gregorian algorithm)
+    a, b, c = year % 19, year // 100, year % 100
+    h       = (19 * a + b - b // 4 - (b - (b + 8) // 25 + 1) // 3 + 15) % 30
+    l       = (32 + 2 * (b % 4) + 2 * (c // 4) - h - c % 4) % 7
+    m       = (a + 11 * h + 22 * l) // 451
+    easter  = date(year, (h + l - 7 * m + 114) // 31, (h + l - 7 * m + 114) % 31 + 1)
+
+    thanksgiving = nth_weekday(11, 3, 4)
+    holidays     = {
+        nth_weekday(1, 0, 3),           # Martin Luther King Jr. Day
+        nth_weekday(2, 0, 3),           # Washington's Birthday
+        easter - timedelta(days=2),     # Good Friday
+        last_weekday(5, 0),             # Memorial Day
+        observed(date(year, 7, 4)),     # Independence Day
+        nth_weekday(9, 0, 1),           # Labor Day
+        thanksgiving,                   # Thanksgiving Day
+        observed(date(year, 12, 25))    # Christmas Day
+    }
+
+    # New Year's Day is not observed on the Friday before when it falls on a Saturday
+    if date(year, 1, 1).weekday() != 5:
+        holidays.add(observed(date(year, 1, 1)))
+
+    # Juneteenth has been a market holiday since 2022
+    if year >= 2022:
+        holidays.add(observed(date(year, 6, 19)))
+
+    # The market closes early the day before Independence Day and Christmas, and the day
+    # after Thanksgiving, as long as those are trading days
+    early_closes = {date(year, 7, 3), thanksgiving + timedelta(days=1), date(year, 12, 24)}
+    early_closes = {d for d in early_closes if d.weekday() < 5 and d not in holidays}
+
+    return frozenset(holidays), frozenset(early_closes)
+
+def MarketCloseTime(day: date) -> dt_time:
+    """
+    Gets the time the market closes on a trading day
+
+    :param day: The trading day in the Eastern Time Zone.
+    :return: EARLY_CLOSE on the days the market closes early, otherwise MARKET_CLOSE.
+    """
+    return EARLY_CLOSE if day in MarketCalendar(day.year)[1] else MARKET_CLOSE
 
-        return True
+def ConfirmMarketOpen() -> bool:
+    """
+    Confirms that the market is open when the calendar says it should be, Yahoo is only asked
+    once every MARKET_CHECK_RATE seconds in case the market was closed for an unscheduled reason.
+    A closed status is only trusted once Yahoo reports it again MARKET_RECHECK seconds later, so
+    a lagging status right at the open doesn't skip the first hour of trading
+    """
+    if time.monotonic() >= _market_check["next_check"]:
+        try:
+            market      = yf.Market("US", session=yf_session, timeout=1)
+            status: str = market.status.get("status")
+            closed      = status is not None and status.upper() == "CLOSED"
+
+        except Exception as e:
+            # Fall back to the calendar if Yahoo can't be reached
+            print(f"Error checking market status: {e}")
+            closed = False
+
+        if closed and not _market_check["suspect"]:
+            # First closed status, keep treating the market as open and ask again shortly
+            _market_check["suspect"]    = True
+            _market_check["closed"]     = False
+            _market_check["next_check"] = time.monotonic() + MARKET_RECHECK
+        else:
+            # Either the closed status was confirmed or the market is open
+            _market_check["suspect"]    = closed
+            _market_check["closed"]     = closed
+            _market_check["next_check"] = time.monotonic() + MARKET_CHECK_RATE
+            if closed:
+                print("Market is closed according to Yahoo but open according to the calendar")
 
-    except Exception as e:
-        print(f"Error checking market status: {e}")
-        return False
+    return not _market_check["closed"]
 
-def InTradingHours() -> bool:
+def ResetMarketCheck() -> None:
     """
-    Checks if the current time is within trading hours
+    Forgets what Yahoo reported about the market status, so the next trading day starts with a
+    fresh check instead of one left over from the previous day
+    """
+    _market_check["closed"]     = False
+    _market_check["suspect"]    = False
+    _market_check["next_check"] = 0.0
+
+def InTradingHours(now: datetime = None) -> bool:
+    """
+    Checks if the current time is within trading hours according to the local NYSE calendar,
+    holidays and early closing days are taken into account
+
+    :param now: The current time in the Eastern Time Zone, fetched if not provided.
     """
 
     # Get the current time in the Eastern Time Zone
-    now = datetime.now(ZoneInfo("America/New_York"))
+    if now is None:
+        now = datetime.now(NY_TZ)
 
     # Check if today is a weekend
     if now.weekday() >= 5:
         return False
-    
-    # Define market open and close times
-    market_open  = now.replace(hour=9, minute=30, second=0, microsecond=0)
-    market_close = now.replace(hour=16, minute=0, second=0, microsecond=0)
 
-    return market_open <= now <= market_close
+    # Check if today is a holiday
+    today = now.date()
+    if today in MarketCalendar(today.year)[0]:
+        return False
+
+    return MARKET_OPEN <= now.time() <= MarketCloseTime(today)
 
-def GetTopGainers(count: int, percent_change: float, intraday_price: float, volume: int,
-                  intraday_market_cap: int = None, us_only: bool = True) -> list[dict]:
+@functools.lru_cache(maxsize=16)
+def BuildGainersQuery(percent_change: float, intraday_price: float, volume: int,
+                      intraday_market_cap: int = None, us_only: bool = True) -> yf.EquityQuery:
     """
-    Fetches the top gainer stocks from Yahoo Finance
+    Builds the Yahoo Finance screener query for top gainers, the query only depends on the
+    filters so it is cached and reused on every tick rather than rebuilt
 
-    :param count: Number of top gainers to fetch.
     :param percent_change: Minimum percentage change to filter gainers.
     :param intraday_price: Minimum intraday price to filter gainers.
     :param volume: Minimum trading volume to filter gainers.
     :param intraday_market_cap: Minimum intraday market cap to filter gainers.
     :param us_only: If True, only fetch US stocks.
-    :return: A list of dictionaries containing ticker symbols and their acquisition timestamps.
+    :return: The combined screener query.
     """
     # Create the query elements based on the provided parameters
     elements = [
@@ -80,208 +219,434 @@ def GetTopGainers(count: int, percent_change: float, intraday_price: float, volu
         elements.append(yf.EquityQuery("GTE", ["intradaymarketcap", intraday_market_cap]))
 
     # Combine the elements into a single query
-    query = yf.EquityQuery("AND", elements)
+    return yf.EquityQuery("AND", elements)
+
+def GetTopGainers(count: int, percent_change: float, intraday_price: float, volume: int,
+                  intraday_market_cap: int = None, us_only: bool = True) -> list[dict]:
+    """
+    Fetches the top gainer stocks from Yahoo Finance
+
+    :param count: Number of top gainers to fetch.
+    :param percent_change: Minimum percentage change to filter gainers.
+    :param intraday_price: Minimum intraday price to filter gainers.
+    :param volume: Minimum trading volume to filter gainers.
+    :param intraday_market_cap: Minimum intraday market cap to filter gainers.
+    :param us_only: If True, only fetch US stocks.
+    :return: A list of dictionaries containing ticker symbols and their acquisition timestamps.
+    """
+    # Reuse the query for these filters
+    query = BuildGainersQuery(percent_change, intraday_price, volume, intraday_market_cap, us_only)
 
     try:
         # Fetch the top gainers using the query and count
-        results: dict          = yf.screen(query, count=count, sortField="percentchange")
+        results: dict          = yf.screen(query, count=count, sortField="percentchange", session=yf_session)
         collection: list[dict] = results.get("quotes", [])
-        dt                     = datetime.now(ZoneInfo("America/New_York"))
+
+        # All of the gainers came from the same query so they share the same timestamps
+        dt       = datetime.now(NY_TZ)
+        ts       = int(dt.timestamp())
+        day      = DAY_NAMES[dt.weekday()]
+        iso      = dt.isoformat()
+        readable = dt.strftime(READABLE_FMT)
+
+        # Quotes without a symbol can't be tracked so they're skipped
         return [{
-                "symbol"            : item.get("symbol"),
-                "timestamp"         : int(time.time()),
-                "day"               : dt.strftime("%A"),
-                "datetime_iso"      : dt.isoformat(),
-                "datetime_readable" : dt.strftime("%m-%d-%y %I:%M:%S.%f %p %Z")
-        } for item in collection]
+                "symbol"            : item["symbol"],
+                "timestamp"         : ts,
+                "day"               : day,
+                "datetime_iso"      : iso,
+                "datetime_readable" : readable
+        } for item in collection if item.get("symbol")]
 
     except Exception as e:
         print(f"Error fetching top gainers: {e}")
         return []
 
-def QueryThread() -> None:
+def SubmitTopGainers(count: int, percent_change: float, intraday_price: float, volume: int,
+                     intraday_market_cap: int = None, us_only: bool = True) -> Future:
     """
-    Queries stock data and maintains a collection of top gainer stocks
+    Runs GetTopGainers on the executor, callers asking for a query that is already in flight
+    share its future rather than sending another identical request to Yahoo
+
+    :param count: Number of top gainers to fetch.
+    :param percent_change: Minimum percentage change to filter gainers.
+    :param intraday_price: Minimum intraday price to filter gainers.
+    :param volume: Minimum trading volume to filter gainers.
+    :param intraday_market_cap: Minimum intraday market cap to filter gainers.
+    :param us_only: If True, only fetch US stocks.
+    :return: A future resolving to the result of GetTopGainers.
     """
+    key = (count, percent_change, intraday_price, volume, intraday_market_cap, us_only)
 
-    # When starting the thread lets align the querying of the endpoints with 
-    # the interval or tick rate of the query thread
-    full_time  = time.time()
-    seconds    = int(full_time)
-    fractional = full_time - seconds
-    remainder  = seconds % int(QUERY_TICK_RATE)
+    def release(future: Future) -> None:
+        with _inflight_lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
 
-    # Sleep until it becomes the desired time
-    time.sleep(QUERY_TICK_RATE - remainder - fractional)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future         = _executor.submit(GetTopGainers, *key)
+            _inflight[key] = future
+            future.add_done_callback(release)
 
-    # Gainers Data
-    todays_gainers: list[dict] = []
+    return future
 
-    while True:
+def GainersToColumns(gainers: list[dict]) -> dict[str, list]:
+    """
+    Converts a list of gainers into a single dictionary of parallel lists, so the field
+    names are stored once instead of once per gainer
 
-        # Main Processing
-        #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-        # Only query for top gainers during trading hours
-        if InTradingHours():
+    :param gainers: The gainers to convert.
+    :return: A dictionary mapping each of the GAINER_COLUMNS to a list of values.
+    """
+    return {column: [g.get(column) for g in gainers] for column in GAINER_COLUMNS}
 
-            # Only query for top gainers if the market is open
-            if IsMarketOpen():
+def LoadTodaysGainers(today: date) -> tuple[list[dict], bool]:
+    """
+    Loads the gainers that were already stored in redis today, so that a restart during the
+    trading day picks up where the application left off instead of adding duplicates
 
-                # For debugging
-                if int(time.time()) % 3600 == 0:
-                    date_time = datetime.now(ZoneInfo("America/New_York"))
-                    print(f"Market is open for {date_time.strftime('%A %m-%d-%y %I:%M:%S.%f %p %Z')}")
-
-                # Query for the top gainers
-                gainers = GetTopGainers(
-                    count=10,
-                    percent_change=10.0,
-                    intraday_price=0.2,
-                    volume=100000
-                )
+    :param today: The current date in the Eastern Time Zone.
+    :return: The gainers that were recorded today in the order they were found, and whether
+             any entries were left out so the list stored in redis needs to be rewritten.
+    """
+    try:
+        entries = redis_client.lrange("todays_gainers", 0, -1)
+
+    except redis.ResponseError as e:
+        # Older versions stored todays gainers as a single JSON string
+        print(f"Error loading todays gainers: {e}")
+        return [], False
+
+    # Only keep the gainers from today in case the list is left over from a previous day, and
+    # only the first entry of each symbol so the list agrees with the set of todays symbols
+    prefix = today.isoformat()
+    gainers: list[dict] = []
+    symbols: set[str]   = set()
+    for entry in entries:
+        try:
+            gainer = orjson.loads(entry)
+
+        except orjson.JSONDecodeError as e:
+            # Skip the bad entry rather than failing to start
+            print(f"Error loading todays gainer {entry!r}: {e}")
+            continue
+
+        if gainer.get("datetime_iso", "").startswith(prefix) and gainer.get("symbol") not in symbols:
+            gainers.append(gainer)
+            symbols.add(gainer.get("symbol"))
+
+    return gainers, 0 < len(gainers) < len(entries)
+
+def MigrateGainersRecord() -> None:
+    """
+    Converts a gainers record stored as a single JSON list into a redis hash keyed by the
+    day of the week, records that are already a hash are left untouched
+    """
 
-                # Update the gainers data locally with any new gainers
-                todays_symbols = [g.get("symbol") for g in todays_gainers]
-                for gainer in gainers:
+    if redis_client.type("gainers_record") != b"string":
+        return
 
-                    # Only add the gainer if it is not already in the list
-                    if gainer.get("symbol") not in todays_symbols:
-                        todays_gainers.append(gainer)
+    # Group the existing gainers by the day they were recorded on, the record was appended
+    # to chronologically so only the most recent date seen for each day is kept
+    existing_gainers: list[dict]    = orjson.loads(redis_client.get("gainers_record"))
+    gainers_by_day: dict[str, list] = {}
+    dates_by_day: dict[str, str]    = {}
+    for gainer in existing_gainers:
+        day         = gainer.get("day")
+        recorded_on = gainer.get("datetime_iso", "")[:10]
+        if dates_by_day.get(day) != recorded_on:
+            dates_by_day[day]   = recorded_on
+            gainers_by_day[day] = []
+
+        gainers_by_day[day].append(gainer)
+
+    # Replace the JSON list with the hash in a single transaction
+    pipe = redis_client.pipeline()
+    pipe.delete("gainers_record")
+    if gainers_by_day:
+        pipe.hset("gainers_record", mapping={
+            day: orjson.dumps(GainersToColumns(g)) for day, g in gainers_by_day.items()
+        })
+    pipe.execute()
 
-                # Overwrite the todays_gainers entries stored in redis, with the new data
-                redis_client.set("todays_gainers", json.dumps(todays_gainers))
+    # For debugging
+    print(f"Migrated gainers record to a hash with {len(gainers_by_day)} days")
 
-        # Outside of trading hours
-        elif not InTradingHours() and len(todays_gainers) > 0:
+def StatusPayload(state: str, timestamp: int, iso: str, readable: str) -> bytes:
+    """
+    Serializes the status of the application that is reported to redis
 
-            # For debugging
-            date_time = datetime.now(ZoneInfo("America/New_York"))
-            print(f"Market is closed for {date_time.strftime('%A %m-%d-%y %I:%M:%S.%f %p %Z')}")
+    :param state: The state of the application, either "alive" or "sleeping".
+    :param timestamp: Unix timestamp of when the application entered the state.
+    :param iso: ISO formatted time of when the application entered the state.
+    :param readable: Human readable time of when the application entered the state.
+    :return: The JSON encoded status.
+    """
+    return orjson.dumps([state, {"since_timestamp": timestamp, "since_iso": iso, "since_readable": readable}])
 
-            gainers_record = redis_client.get("gainers_record")
-            if gainers_record is None:
+def FlushPipeline(pipe: redis.client.Pipeline) -> bool:
+    """
+    Sends all of the redis commands staged on the pipeline, failures are reported rather
+    than raised so that a stalled or unreachable redis doesn't take down the query thread
 
-                # If we don't have a gainers record yet, set it to todays_gainers
-                redis_client.set("gainers_record", json.dumps(todays_gainers))
-            else:
-                # If we already have a gainers record, we can append to it
-                existing_gainers: list[dict] = json.loads(gainers_record)
+    :param pipe: The pipeline to flush.
+    :return: True if every command made it to redis, False otherwise.
+    """
+    try:
+        success = True
+        for result in pipe.execute(raise_on_error=False):
+            if isinstance(result, Exception):
+                print(f"Error writing to redis: {result}")
+                success = False
 
-                # Check if we have already recorded gainers for this day of this week
-                day_of_the_week = datetime.now(ZoneInfo("America/New_York")).strftime("%A")
-                if any(day_of_the_week in g for g in existing_gainers):
+        return success
 
-                    # If we have already recorded gainers for this day, remove them
-                    existing_gainers = [g for g in existing_gainers if day_of_the_week not in g]
+    except redis.RedisError as e:
+        print(f"Error writing to redis: {e}")
+        return False
 
-                # Append today's gainers to the existing gainers record
-                existing_gainers += todays_gainers
+def StageTodaysGainers(pipe: redis.client.Pipeline, todays_gainers: list[dict], unsent_entries: list[dict],
+                       rewrite: bool, today: date) -> None:
+    """
+    Stages sending the gainers redis doesn't have yet to the todays_gainers list stored in redis.
+    Appending isn't idempotent, so after a failed flush that redis may have applied anyway the
+    whole list is rewritten instead of appending the same gainers again
+
+    :param pipe: The pipeline to stage the commands on.
+    :param todays_gainers: All of the gainers found today.
+    :param unsent_entries: The gainers that haven't made it to redis yet.
+    :param rewrite: If True, the list is replaced with all of todays gainers.
+    :param today: The current date in the Eastern Time Zone.
+    """
 
-                # Update the gainers record in redis
-                redis_client.set("gainers_record", json.dumps(existing_gainers))
+    # If none of todays gainers made it to redis yet, they also replace whatever is left over
+    # in the list from a previous day
+    if rewrite or len(unsent_entries) == len(todays_gainers):
+        pipe.delete("todays_gainers")
+        entries = todays_gainers
+    else:
+        entries = unsent_entries
 
-            # Clear the gainers data at the end of the trading day
-            todays_gainers.clear()
+    pipe.rpush("todays_gainers", *[orjson.dumps(e) for e in entries])
 
-        # Outside of trading hours and todays_gainers is empty, just report status
-        else:
+    # Let redis clean up todays gainers an hour after the market closes, so the data doesn't
+    # linger if this application dies before the end of the day
+    market_close = datetime.combine(today, MarketCloseTime(today), NY_TZ)
+    pipe.expireat("todays_gainers", int(market_close.timestamp()) + 3600)
 
-            # If its the weekend or after market closure on a weekday, we can just
-            # wait until the next market opening
-            wait_until_open = False
-
-            # NOTE: There might also be a very small chance of a bug if the application
-            #       falls here exactly at midnight and becomes 00:00:01 after the condition
-            #       is checked which would lead to sleeping for the entire week.
-            if datetime.now(ZoneInfo("America/New_York")).weekday() >= 5:
-                # If it's the weekend, sleep until the next Monday at 9:25 AM
-                current_time  = datetime.now(ZoneInfo("America/New_York"))
-                days_ahead    = 7 - current_time.weekday()
-                next_opening  = (current_time + timedelta(days=days_ahead)).replace(hour=9, minute=25, second=0, microsecond=0)
-                time_to_sleep = (next_opening - current_time).total_seconds()
-
-                wait_until_open = True
-            else:
+def NextMarketOpen(now: datetime) -> datetime:
+    """
+    Finds the time the query thread should wake up at before the next market opening
 
-                # Now we can just wait until the next market opening
-                current_time = datetime.now(ZoneInfo("America/New_York"))
+    :param now: The current time in the Eastern Time Zone, outside of trading hours.
+    :return: 9:25 AM on the next trading day, today counts if the market hasn't opened yet.
+    """
+    next_opening = now.replace(hour=9, minute=25, second=0, microsecond=0)
 
-                # If we wait until the next market open, by the time we end up here the next day the current time
-                # should always be before market open, so this should prevent any issues with falling into an infinite
-                # loop of sleeping for one day at a time
-                if current_time.hour >= 16 and current_time.minute >= 0 and current_time.second >= 0:
+    # Outside of trading hours and past the opening time means the market is closed for the
+    # day, so the next opening is tomorrow at the earliest
+    if now.time() >= MARKET_OPEN:
+        next_opening += timedelta(days=1)
 
-                    # If it's after market close, sleep until the next day at 9:25 AM otherwise wait until
-                    # the market opens today at 9:25 AM
-                    next_opening = (current_time + timedelta(days=1)).replace(hour=9, minute=25, second=0, microsecond=0)
+    # Skip over the weekend and holidays
+    while next_opening.weekday() >= 5 or next_opening.date() in MarketCalendar(next_opening.year)[0]:
+        next_opening += timedelta(days=1)
 
-                    if next_opening.weekday() >= 5:
-                        # If the next day is a weekend, adjust to the following Monday
-                        days_ahead    = 7 - next_opening.weekday()
-                        next_opening  = (next_opening + timedelta(days=days_ahead)).replace(hour=9, minute=25, second=0, microsecond=0)
+    return next_opening
 
-                    time_to_sleep = (next_opening - current_time).total_seconds()
+def SleepUntilNextTick(deadline: float = None) -> float:
+    """
+    Sleeps until the deadline of the next tick, the monotonic clock is used so that adjustments
+    to the system clock don't cause drift and any ticks that were missed while processing are
+    skipped rather than run back to back. Ticks are evenly spaced by the tick rate but since the
+    monotonic clock has an arbitrary starting point they aren't phase-locked to the wall clock
+
+    :param deadline: The deadline of the tick that just ran, if not provided the next multiple
+                     of the tick rate on the monotonic clock is used.
+    :return: The deadline that was slept until.
+    """
+    now = time.monotonic()
+    if deadline is None:
+        next_deadline = math.ceil(now / QUERY_TICK_RATE) * QUERY_TICK_RATE
+    else:
+        next_deadline = deadline + QUERY_TICK_RATE
 
-                    wait_until_open = True
+        # If ticks were missed, realign with the next multiple of the tick rate on the monotonic clock
+        if next_deadline < now:
+            next_deadline = math.ceil(now / QUERY_TICK_RATE) * QUERY_TICK_RATE
 
-                # If we wait until the market opens today, by the time we end up here the current time
-                # should always be after the if statement below so this should prevent any issues with falling
-                # into this code block multiple times in a row
-                # NOTE: There might be a bug if the application falls here exactly at 9:24:59 and becomes
-                #       9:25:00 after the condition is checked which would lead to calculating a time to sleep
-                #       of 1 second or less and possibly even a negative time to sleep. Fixed by checking if
-                #       the time to sleep is positive before going to sleep
-                elif current_time.hour <= 9 and current_time.minute < 25:
+    time.sleep(max(0.0, next_deadline - time.monotonic()))
+    return next_deadline
 
-                    # If it's before market open, sleep until today at 9:25 AM
-                    next_opening  = current_time.replace(hour=9, minute=25, second=0, microsecond=0)
-                    time_to_sleep = (next_opening - current_time).total_seconds()
+def QueryThread() -> None:
+    """
+    Queries stock data and maintains a collection of top gainer stocks
+    """
+
+    # When starting the thread lets wait for the first tick deadline, the ticks are evenly
+    # spaced by the tick rate but aren't aligned with the wall clock
+    deadline = SleepUntilNextTick()
 
-                    # We can prevent a potential bug checking if the time to sleep is positive
-                    if time_to_sleep > 0:
-                        wait_until_open = True
+    # Gainers Data, picking up where we left off if the application was restarted during the day
+    todays_gainers, rewrite_gainers = LoadTodaysGainers(datetime.now(NY_TZ).date())
+    todays_symbol_set: set[str]     = {g.get("symbol") for g in todays_gainers}
 
-            if wait_until_open:
+    # Gainers that still have to be appended to the todays_gainers list stored in redis, they
+    # stay queued until a flush succeeds so a redis failure doesn't lose them. After a failed
+    # flush, or a load that left out entries, the whole list is rewritten since redis may
+    # still hold entries that shouldn't be appended to
+    unsent_entries: list[dict] = []
 
-                # Tell redis that this applications is sleeping until the next market opening
-                redis_client.set("status", json.dumps([
-                    "sleeping",
-                    {
-                        "since_timestamp" : int(time.time()),
-                        "since_iso"       : datetime.now(ZoneInfo("America/New_York")).isoformat(),
-                        "since_readable"  : datetime.now(ZoneInfo("America/New_York")).strftime("%m-%d-%y %I:%M:%S.%f %p %Z")
-                    }
-                ]))
+    # Top gainers query that is still waiting on a response from Yahoo
+    pending_future: Future | None = None
+
+    while True:
+
+        # All of the redis writes for this tick are batched into a single round-trip
+        pipe           = redis_client.pipeline(transaction=False)
+        staged_gainers = False
+
+        # Fetch the current time once per tick and reuse it throughout the loop
+        now_et       = datetime.now(NY_TZ)
+        now_ts       = int(now_et.timestamp())
+        now_iso      = now_et.isoformat()
+        now_readable = now_et.strftime(READABLE_FMT)
+        in_hours     = InTradingHours(now_et)
+
+        # Outside of trading hours drop any query that is still in flight and the market status
+        # from Yahoo, so neither of them is picked up on the next trading day
+        if not in_hours:
+            ResetMarketCheck()
+            if pending_future is not None:
+                pending_future.cancel()
+                pending_future = None
+
+        # Main Processing
+        #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+        # Only query for top gainers during trading hours
+        if in_hours:
+
+            # Only query for top gainers if the market is open, the calendar was already
+            # checked so only an unscheduled closure is left to rule out
+            if ConfirmMarketOpen():
+
+                # For debugging, ticks are no longer aligned to the wall clock so report on the
+                # first tick of every hour
+                if now_et.minute == 0 and now_et.second < QUERY_TICK_RATE:
+                    print(f"Market is open for {DAY_NAMES[now_et.weekday()]} {now_readable}")
+
+                # Query for the top gainers unless the previous query is still in flight
+                if pending_future is None:
+                    pending_future = SubmitTopGainers(
+                        count=10,
+                        percent_change=10.0,
+                        intraday_price=0.2,
+                        volume=100000
+                    )
+
+                # Only wait on the query for part of the tick, if Yahoo is being slow the
+                # results will be picked up on a later tick instead
+                try:
+                    gainers        = pending_future.result(timeout=QUERY_WAIT_TIME)
+                    pending_future = None
+
+                except FutureTimeoutError:
+                    gainers = []
+
+                # Throw away any results that came from a query made on a previous trading day
+                today_iso = now_et.date().isoformat()
+                gainers   = [g for g in gainers if g.get("datetime_iso", "").startswith(today_iso)]
+
+                # Update the gainers data locally with any new gainers
+                for gainer in gainers:
+
+                    # Only add the gainer if it is not already in the list
+                    symbol = gainer.get("symbol")
+                    if symbol not in todays_symbol_set:
+                        todays_symbol_set.add(symbol)
+                        todays_gainers.append(gainer)
+                        unsent_entries.append(gainer)
+
+            # Only send the gainers redis doesn't have yet
+            if unsent_entries or rewrite_gainers:
+                StageTodaysGainers(pipe, todays_gainers, unsent_entries, rewrite_gainers, now_et.date())
+                staged_gainers = True
+
+        # Outside of trading hours
+        elif len(todays_gainers) > 0:
+
+            # For debugging
+            print(f"Market is closed for {DAY_NAMES[now_et.weekday()]} {now_readable}")
+
+            # Send any of todays gainers redis doesn't have yet
+            if unsent_entries or rewrite_gainers:
+                StageTodaysGainers(pipe, todays_gainers, unsent_entries, rewrite_gainers, now_et.date())
+                staged_gainers = True
+
+            # Record todays gainers under the current day of the week, replacing the gainers
+            # that were recorded on this day last week
+            pipe.hset("gainers_record", DAY_NAMES[now_et.weekday()], orjson.dumps(GainersToColumns(todays_gainers)))
+
+            # Clear the gainers data at the end of the trading day, but only once the record is
+            # safely in redis. Otherwise it's kept and the next tick tries again
+            if FlushPipeline(pipe):
+                todays_gainers.clear()
+                todays_symbol_set.clear()
+                unsent_entries.clear()
+                rewrite_gainers = False
+            else:
+                rewrite_gainers = rewrite_gainers or staged_gainers
+
+            # The gainers were handled by this flush rather than the one at the end of the tick
+            staged_gainers = False
+
+        # Outside of trading hours and todays_gainers is empty, just report status
+        else:
+
+            # If its the weekend, a holiday or after market closure on a weekday, we can
+            # just wait until right before the next market opening. Between 9:25 AM and the
+            # market opening the time to sleep is not positive so we keep ticking
+            next_opening  = NextMarketOpen(now_et)
+            time_to_sleep = next_opening.timestamp() - now_et.timestamp()
+
+            if time_to_sleep > 0:
+
+                # Tell redis that this applications is sleeping until the next market opening,
+                # this has to be flushed now rather than at the end of the tick
+                pipe.set("status", StatusPayload("sleeping", now_ts, now_iso, now_readable),
+                         ex=int(time_to_sleep) + STATUS_TTL)
+                FlushPipeline(pipe)
 
                 # For debugging
-                date_time = datetime.now(ZoneInfo("America/New_York"))
-                print(f"Sleeping from {date_time.strftime('%A %m-%d-%y %I:%M:%S.%f %p %Z')} until market opens for {time_to_sleep} seconds")
+                print(f"Sleeping from {DAY_NAMES[now_et.weekday()]} {now_readable} until market opens for {time_to_sleep} seconds")
 
-                # Sleep until the right before the next market opening
+                # Sleep until the right before the next market opening, then start over with
+                # a fresh tick since everything computed for this one is stale
                 time.sleep(time_to_sleep)
-
-        # If we made it here, then the application is alive and well
-        redis_client.set("status", json.dumps([
-            "alive",
-            {
-                "since_timestamp" : int(time.time()),
-                "since_iso"       : datetime.now(ZoneInfo("America/New_York")).isoformat(),
-                "since_readable"  : datetime.now(ZoneInfo("America/New_York")).strftime("%m-%d-%y %I:%M:%S.%f %p %Z")
-            }
-        ]))
+                continue
+
+        # If we made it here, then the application is alive and well. The status expires
+        # if it isn't refreshed so a dead process doesn't keep reporting that it's alive
+        pipe.set("status", StatusPayload("alive", now_ts, now_iso, now_readable), ex=STATUS_TTL)
+
+        # Flush all of the redis writes for this tick, the queued gainers are only dropped
+        # once they made it to redis and otherwise the whole list is rewritten next time
+        flushed = FlushPipeline(pipe)
+        if staged_gainers:
+            if flushed:
+                unsent_entries.clear()
+                rewrite_gainers = False
+            else:
+                rewrite_gainers = True
 
         #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
         # Worst case scenario for how long the code in the loop we're in to take is well below
         # the tick rate of the application, therefore we don't really need to time the duration
         # the processor took to execute this loop, which means that we can just sleep until the
-        # the next moment in time that is divisible by the tick rate
-        full_time  = time.time()
-        seconds    = int(full_time)
-        fractional = full_time - seconds
-        remainder  = seconds % int(QUERY_TICK_RATE)
-
-        # Sleep for the remainder amount of time till the next tick of the loop
-        time.sleep(QUERY_TICK_RATE - remainder - fractional)
+        # next tick deadline, one tick rate after the deadline of this tick
+        deadline = SleepUntilNextTick(deadline)
 
 def main() -> None:
     """
@@ -301,13 +666,42 @@ def main() -> None:
         print(f"Argument Parsing Failed - {e}")
         return
     
-    # Initialize Redis Client
+    # TCP keep-alive settings for the connections to redis, not every platform supports all of them
+    keepalive_options = {
+        getattr(socket, option): value
+        for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+        if hasattr(socket, option)
+    }
+
+    # Initialize Redis Client, the connections are kept alive and health checked so that the
+    # long sleeps outside of trading hours don't leave the client with a dead connection.
+    # Retries are disabled since redis-py replays the whole pipeline on a timeout and the
+    # appends to todays gainers aren't idempotent, a failed flush is handled by QueryThread
     global redis_client
-    redis_client = redis.Redis(host=args.ip, port=args.port, db=0, password=args.password)
+    pool = redis.ConnectionPool(
+        host=args.ip,
+        port=args.port,
+        db=0,
+        password=args.password,
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT,
+        socket_keepalive=True,
+        socket_keepalive_options=keepalive_options,
+        health_check_interval=30,
+        retry=Retry(NoBackoff(), 0)
+    )
+    redis_client = redis.Redis(connection_pool=pool)
 
     # For debugging
     print(f"Connected to Redis at {args.ip}:{args.port}")
 
+    # Older versions stored the gainers record as a single JSON list
+    MigrateGainersRecord()
+
+    # Initialize the HTTP session used for all of the Yahoo queries
+    global yf_session
+    yf_session = curl_requests.Session(impersonate="chrome")
+
     # Start the Query Thread
     QueryThread()
 